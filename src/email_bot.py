@@ -1,29 +1,45 @@
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pymupdf
 import pymupdf4llm
 from openai import OpenAI
-from habanero import Crossref
 import time
 import hashlib
 import json
+import functools
+import itertools
+import contextlib
 import shutil
 import zipfile
+import mimetypes
+import tempfile
 import socket
+import ssl
 import imaplib
-import email
 import smtplib
 import datetime
 import logging
+import xml.etree.ElementTree as ET
+import atexit
+import threading
+import multiprocessing
 from datetime import timedelta
-from email.header import decode_header
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from urllib.parse import unquote, urlparse, parse_qs
-import markdown
+from collections import Counter, defaultdict
+from email.header import decode_header, make_header
+from email.message import EmailMessage
+from email import policy
+from email.parser import BytesHeaderParser, BytesParser
+from urllib.parse import quote, unquote, urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import mistune
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from tenacity import retry, stop_after_attempt, wait_exponential
+try: import orjson
+except ImportError: orjson = None
 
 # --- 配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,23 +50,74 @@ LLM_BASE_URL = "https://api.siliconflow.cn/v1"
 LLM_MODEL_NAME = os.environ.get("LLM_MODEL_NAME", "deepseek-ai/DeepSeek-R1-distill-llama-70b")
 EMAIL_USER = os.environ.get("EMAIL_USER")
 EMAIL_PASS = os.environ.get("EMAIL_PASS")
+CONTACT_EMAIL = os.environ.get("CONTACT_EMAIL") or EMAIL_USER or "bot@example.com"  # Crossref/Unpaywall 礼貌池标识
 IMAP_SERVER = "imap.gmail.com"
 SMTP_SERVER = "smtp.gmail.com"
 SCHEDULER_MODE = False
 LOOP_INTERVAL_HOURS = 4
+IDLE_REFRESH = 29 * 60  # Gmail 等服务器约 30 分钟断开 IDLE，提前重发
 BATCH_SIZE = 20
 MAX_RETRIES = 3
+IMAP_FETCH_CHUNK = 50
+IMAP_FULL_FETCH_MAX = 1024 * 1024  # 超过此大小的邮件只取文本段
+DOWNLOAD_WORKERS = 5
+ANALYZE_WORKERS = 5  # 受 LLM 接口 RPM 限制
+TRANSLATE_BATCH = 20  # 每次批量翻译的标题数
+DOMAIN_RATE, DOMAIN_BURST = 1.0, 3  # 同域下载：每秒补 1 个令牌，最多攒 3 个
+DOMAIN_CONCURRENCY = 2
+OA_WORKERS = 8
+PDF_WORKERS = os.cpu_count() or 2
 TARGET_SUBJECTS = ["文献鸟", "Google Scholar Alert", "ArXiv", "Project MUSE", "new research", "Stork", "ScienceDirect", "Chinese politics", "Imperial history", "Causal inference", "new results", "The Accounting Review", "recommendations available", "Table of Contents"]
+_SUBJECT_RE = re.compile("|".join(map(re.escape, TARGET_SUBJECTS)), re.IGNORECASE)
+# arXiv / DOI 合并为一个正则，正文只扫一遍；m.lastgroup 即类型
+_ID_RE = re.compile(r"(?:arXiv:|arxiv\.org/abs/|arxiv\.org/pdf/)\s*(?P<arxiv>\d{4}\.\d{4,5})(?!\d)"
+                    r"|(?:doi:|doi\.org/)\s*(?P<doi>10\.\d{4,9}/[-._;()/:A-Z0-9]+)", re.IGNORECASE)
+_URL_RE = re.compile(r'(https?://[^\s"\'<>]+)')
+LINK_BLOCKLIST = ['unsubscribe', 'twitter', 'facebook']
+_BLOCK_RE = re.compile("|".join(map(re.escape, LINK_BLOCKLIST)))
+_NONWORD_RE = re.compile(r'[\W_]+')
+_THINK_RE = re.compile(r'<think>.*?</think>', re.S)
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.S)
+_UNSAFE_FN_RE = re.compile(r'[\\/*?:"<>|]')
+_ABSTRACT_RE = re.compile(r"TITLE:\s*(.*?)\n\nABSTRACT:\s*(.*)", re.DOTALL)
+_TITLE_RE = re.compile(r"TITLE:\s*(.*)", re.I)
+_IMAP_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+_IMAP_SECTION_RE = re.compile(rb'BODY\[([\d.]+)\]')
+_IMAP_EXISTS_RE = re.compile(rb'^\* \d+ EXISTS', re.I)
+_SEXP_TOKEN_RE = re.compile(rb'\(|\)|"(?:\\.|[^"\\])*"|[^\s()"]+')
+_BACKMATTER_RE = re.compile(r'^#{1,6}\s*\**\s*(?:[\dIVX]+\.?\s*)?(?:References|Bibliography|Acknowledg|Appendix|Supplementary|参考文献|致谢|附录)', re.I | re.M)
 
 DATA_DIR = "data"
 DB_FILE = os.path.join(DATA_DIR, "papers_database.json")
 EMAIL_RECORD_FILE = os.path.join(DATA_DIR, "processed_emails.json")
+IMAP_STATE_FILE = os.path.join(DATA_DIR, "imap_state.json")  # 上轮扫描到的 UIDNEXT，增量搜索用
+LLM_CACHE_FILE = os.path.join(DATA_DIR, "llm_cache.json")
+LLM_CACHE_DAYS = 30
+API_CACHE_FILE = os.path.join(DATA_DIR, "api_cache.json")
+API_CACHE_DAYS = 30
+NEG_CACHE_DAYS = 7
 DOWNLOAD_DIR = "downloads"
+MD_CACHE_DIR = os.path.join(DOWNLOAD_DIR, "md")
+DOWNLOAD_KEEP_DAYS = 7
 MAX_EMAIL_ZIP_SIZE = 18 * 1024 * 1024 
+MAX_PDF_BYTES = 100 * 1024 * 1024
+MAX_HTML_BYTES = 1024 * 1024  # 落地页嗅探只读前 1MB，PDF 链接/citation meta 都在前部
+ARXIV_API = "https://export.arxiv.org/api/query"
+CROSSREF_API = "https://api.crossref.org/works"
+_ATOM = "{http://www.w3.org/2005/Atom}"
+STORED_EXTS = {".pdf", ".zip", ".jpg", ".png", ".docx"}  # 已压缩格式，不再 DEFLATE
 socket.setdefaulttimeout(30)
 client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
-cr = Crossref()
-DOMAIN_LAST_ACCESSED = {}
+_CROSSREF_HEADERS = {"User-Agent": f"PaperBot/1.0 (mailto:{CONTACT_EMAIL})"}
+_DOMAIN_BUCKETS = {}
+_DOMAIN_SEMS = {}
+_IMAP_POOL = {}
+_IDLE_TAGS = itertools.count(1)
+_SSL_CTX = ssl.create_default_context()  # IMAP/SMTP 共用，避免每次连接重新加载 CA
+_PDF_LOCK = threading.Lock()
+_PDF_POOL = None
+_HDR_PARSER = BytesHeaderParser()  # 只解析头部，不构建正文结构
+_MSG_PARSER = BytesParser(policy=policy.default)
 
 # 全局 Session
 session = requests.Session()
@@ -60,8 +127,30 @@ session.headers.update({
     "Accept-Language": "en-US,en;q=0.5",
     "Referer": "https://scholar.google.com/"
 })
+# 连接池需覆盖并发下载线程数，TLS 连接跨请求复用；5xx 网关抖动自动重试，最终仍返回响应交给调用方判断
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(
+    total=2, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504], raise_on_status=False))
+session.mount("https://", _ADAPTER)
+session.mount("http://", _ADAPTER)
 
 # --- 辅助 ---
+def json_read(fp):
+    with open(fp, 'rb') as f:
+        return orjson.loads(f.read()) if orjson else json.load(f)
+
+def json_write(fp, obj, indent=False):
+    """orjson 可用时直接写 UTF-8 字节，否则回退标准库"""
+    if orjson: raw = orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    else: raw = json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+    with open(fp, 'wb') as f: f.write(raw)
+
+def fast_subject(raw):
+    """纯 ASCII 且无 encoded-word 的主题直接返回，否则完整解码（含多段/不同字符集）"""
+    raw = " ".join(raw.split())  # compat32 头部值保留折行 (\r\n + 空白)，先展开
+    if raw.isascii() and "=?" not in raw: return raw
+    try: return str(make_header(decode_header(raw)))
+    except Exception: return raw
+
 def clean_google_url(url):
     try:
         url = unquote(url)
@@ -73,6 +162,11 @@ def clean_google_url(url):
     except: pass
     return url
 
+@functools.lru_cache(maxsize=4096)
+def url_hash(url):
+    # 仅作短 ID，沿用 md5 以保持与历史库中 link_xxx 的 ID 一致
+    return hashlib.md5(url.encode(), usedforsecurity=False).hexdigest()[:10]
+
 def is_valid_academic_text(text):
     if not text or len(text) < 500: return False
     junk_triggers = ["access denied", "security check", "human verification", "cloudflare", "403 forbidden", "404 not found", "robot", "captcha", "please enable cookies"]
@@ -97,27 +191,35 @@ def startup_check():
 class EmailHistory:
     def __init__(self, filepath):
         self.filepath = filepath
+        self.logpath = os.path.splitext(filepath)[0] + ".log"  # 追加日志，崩溃后与 JSON 合并
         self.data = self._load()
 
     def _load(self):
+        data = set()
         if os.path.exists(self.filepath):
+            try: data = set(json_read(self.filepath))
+            except: pass
+        if os.path.exists(self.logpath):
             try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    return set(json.load(f))
+                with open(self.logpath, 'r', encoding='utf-8') as f:
+                    data.update(l.strip() for l in f if l.strip())
             except: pass
-        return set()
+        return data
 
     def add(self, msg_id):
+        if msg_id in self.data: return
         self.data.add(msg_id)
-        self._save()
+        try:
+            with open(self.logpath, 'a', encoding='utf-8') as f: f.write(msg_id + "\n")
+        except: pass
 
     def exists(self, msg_id):
         return msg_id in self.data
 
-    def _save(self):
+    def save(self):
         try:
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(list(self.data), f)
+            json_write(self.filepath, sorted(self.data))
+            if os.path.exists(self.logpath): os.remove(self.logpath)
         except: pass
 
 # --- 论文数据库 ---
@@ -125,74 +227,222 @@ class PaperDB:
     def __init__(self, filepath):
         self.filepath = filepath
         self.data = self._load()
+        self.dirty = False
+        # 🟢 状态索引：待办查询只看相关状态，不随历史条目总数线性增长；_pos 保留原有先后顺序
+        self._pos = {pid: i for i, pid in enumerate(self.data)}
+        self._by_status = defaultdict(set)
+        for pid, item in self.data.items(): self._by_status[item.get("status")].add(pid)
 
     def _load(self):
         if os.path.exists(self.filepath):
             try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    content = json.load(f)
-                    if isinstance(content, list): 
-                        new_data = {}
-                        for item in content:
-                            if isinstance(item, dict) and 'id' in item: new_data[item['id']] = item
-                        return new_data
-                    if isinstance(content, dict): return content
+                content = json_read(self.filepath)
+                if isinstance(content, list): 
+                    new_data = {}
+                    for item in content:
+                        if isinstance(item, dict) and 'id' in item: new_data[item['id']] = item
+                    return new_data
+                if isinstance(content, dict): return content
             except: pass
         return {}
 
     def save(self):
+        """整库重写代价随条目数增长：改动只置脏标记，由 run() 在各阶段结束时统一落盘"""
+        if not self.dirty: return
         try:
             os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
+            json_write(self.filepath, self.data, indent=True)
+            self.dirty = False
         except Exception as e: logger.error(f"保存失败: {e}")
 
     def add_new(self, pid, meta):
-        if not isinstance(self.data, dict): self.data = {}
         if pid not in self.data:
             self.data[pid] = {**meta, "status": "NEW", "retry": 0, "ts": str(datetime.datetime.now())}
-            self.save()
+            self._pos[pid] = len(self._pos)
+            self._by_status["NEW"].add(pid)
+            self.dirty = True
             return True
         return False
 
     def update_status(self, pid, status, extra=None):
         if pid in self.data:
+            self._by_status[self.data[pid].get("status")].discard(pid)
+            self._by_status[status].add(pid)
             self.data[pid]["status"] = status
             if extra: self.data[pid].update(extra)
-            self.save()
+            self.dirty = True
+
+    def _pending(self, statuses, retry_status, limit):
+        pids = [p for st in statuses for p in self._by_status[st]]
+        pids += [p for p in self._by_status[retry_status] if self.data[p].get("retry", 0) < MAX_RETRIES]
+        return [self.data[p] for p in sorted(pids, key=self._pos.get)[:limit]]
 
     def get_pending_downloads(self, limit=BATCH_SIZE):
-        res = []
-        if not isinstance(self.data, dict): return res
-        for pid, item in self.data.items():
-            if item["status"] == "NEW": res.append(item)
-            elif item["status"] == "DOWNLOAD_FAILED" and item.get("retry", 0) < MAX_RETRIES: res.append(item)
-        return res[:limit]
+        return self._pending(["NEW"], "DOWNLOAD_FAILED", limit)
 
     def get_pending_analysis(self, limit=BATCH_SIZE):
-        res = []
-        if not isinstance(self.data, dict): return res
-        for pid, item in self.data.items():
-            if item["status"] in ["DOWNLOADED", "ABSTRACT_ONLY"]: res.append(item)
-            elif item["status"] == "ANALYSIS_FAILED" and item.get("retry", 0) < MAX_RETRIES: res.append(item)
-        return res[:limit]
+        return self._pending(["DOWNLOADED", "ABSTRACT_ONLY"], "ANALYSIS_FAILED", limit)
 
     def inc_retry(self, pid):
         if pid in self.data:
             self.data[pid]["retry"] = self.data[pid].get("retry", 0) + 1
-            self.save()
+            self.dirty = True
+
+# --- 限速 ---
+class TokenBucket:
+    """令牌桶：只在真正发请求时扣令牌，空闲时攒下突发额度"""
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait: time.sleep(wait)
+
+def polite_wait(url):
+    """按域名限速，替代固定 sleep"""
+    host = urlparse(url).netloc
+    bucket = _DOMAIN_BUCKETS.get(host) or _DOMAIN_BUCKETS.setdefault(host, TokenBucket(DOMAIN_RATE, DOMAIN_BURST))
+    bucket.acquire()
+
+@contextlib.contextmanager
+def domain_slot(url):
+    """同域最多 DOMAIN_CONCURRENCY 个并发下载，且按令牌桶限速"""
+    host = urlparse(url).netloc
+    sem = _DOMAIN_SEMS.get(host) or _DOMAIN_SEMS.setdefault(host, threading.Semaphore(DOMAIN_CONCURRENCY))
+    with sem:
+        polite_wait(url)
+        yield
+
+# --- 响应缓存 ---
+class JsonCache:
+    """带过期时间的 KV 缓存，落盘到 data/ 以便随数据一起提交"""
+    def __init__(self, filepath, ttl_days):
+        self.filepath = filepath
+        self.ttl = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.data = self._load()
+        self.dirty = False
+
+    def _load(self):
+        if os.path.exists(self.filepath):
+            try:
+                now = time.time()
+                return {k: v for k, v in json_read(self.filepath).items() if v.get("exp", 0) > now}
+            except: pass
+        return {}
+
+    def get(self, key, default=None):
+        with self.lock: hit = self.data.get(key)
+        if hit and hit["exp"] > time.time(): return hit["v"]
+        return default
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = {"v": value, "exp": time.time() + (ttl or self.ttl)}
+            self.dirty = True
+
+    def save(self):
+        """每次 set 都整文件重写会随缓存增长变成 O(N)，且在锁内串行化所有线程：改为阶段结束时统一落盘"""
+        with self.lock:
+            if not self.dirty: return
+            try:
+                os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+                json_write(self.filepath, self.data)
+                self.dirty = False
+            except Exception as e: logger.error(f"缓存保存失败: {e}")
+
+LLM_CACHE = JsonCache(LLM_CACHE_FILE, LLM_CACHE_DAYS)
+API_CACHE = JsonCache(API_CACHE_FILE, API_CACHE_DAYS)
+
+@atexit.register
+def _flush_caches():
+    LLM_CACHE.save(); API_CACHE.save()
+_MISS = object()
+
+def llm_key(*parts):
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
 
 # --- 核心 ---
+def title_key(text):
+    return llm_key(LLM_MODEL_NAME, f"Translate title to Chinese: {text}", 0.1)
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=10), reraise=False)
 def translate_title(text):
     if not text or len(text) < 5 or "Unknown" in text: return ""
+    key = title_key(text)
+    hit = LLM_CACHE.get(key)
+    if hit: return hit
     try:
         res = client.chat.completions.create(
             model=LLM_MODEL_NAME, messages=[{"role": "user", "content": f"Translate title to Chinese: {text}"}], temperature=0.1
         )
-        return res.choices[0].message.content.strip()
+        out = res.choices[0].message.content.strip()
+        if out: LLM_CACHE.set(key, out)
+        return out
     except: return ""
 
+def _translate_batch(titles):
+    """一次请求翻译一组标题，返回等长列表；失败或条数不符返回 []"""
+    try:
+        src = json.dumps([" ".join(t.split()) for t in titles], ensure_ascii=False)
+        res = client.chat.completions.create(
+            model=LLM_MODEL_NAME,
+            messages=[{"role": "system", "content": "你是学术翻译助手。只输出 JSON 字符串数组，长度与顺序必须与输入一致。"},
+                      {"role": "user", "content": f"把下面 JSON 数组中的每个标题翻译成中文，返回同样长度的 JSON 数组：\n{src}"}], temperature=0.1
+        )
+        raw = _THINK_RE.sub("", res.choices[0].message.content)
+        m = _JSON_ARRAY_RE.search(raw)
+        arr = json.loads(m.group(0)) if m else []
+        if isinstance(arr, list) and len(arr) == len(titles) and all(isinstance(x, str) for x in arr): return [x.strip() for x in arr]
+    except Exception as e: logger.warning(f"    ⚠️ 批量翻译失败: {e}")
+    return []
+
+def translate_titles(texts):
+    """批量翻译：缓存命中直接返回，其余每 TRANSLATE_BATCH 条合并为一次 JSON 数组请求并发发出；某组条数对不上则该组逐条回退"""
+    out = [""] * len(texts)
+    todo = []
+    for i, t in enumerate(texts):
+        if not t or len(t) < 5 or "Unknown" in t: continue
+        hit = LLM_CACHE.get(title_key(t))
+        if hit: out[i] = hit
+        else: todo.append(i)
+    if not todo: return out
+
+    # 组越大越容易漏行/错位，一旦错位整组都要逐条重来
+    chunks = [todo[k:k + TRANSLATE_BATCH] for k in range(0, len(todo), TRANSLATE_BATCH)]
+    with ThreadPoolExecutor(max_workers=min(ANALYZE_WORKERS, len(chunks))) as ex:
+        results = list(ex.map(lambda c: _translate_batch([texts[i] for i in c]), chunks))
+    for idx, lines in zip(chunks, results):
+        if lines:
+            for i, tr in zip(idx, lines):
+                out[i] = tr
+                LLM_CACHE.set(title_key(texts[i]), tr)
+        else:
+            for i in idx: out[i] = translate_title(texts[i])
+    return out
+
+def render_card(disp, tt, badge, link_html, ans):
+    return f"""
+### {disp} {badge}
+> **{tt}**
+
+{link_html}
+
+{ans}
+            """
+
+def norm_title(t):
+    """标题归一化：忽略大小写、标点与空白"""
+    return _NONWORD_RE.sub('', t.lower())
+
 def get_meta_safe(src):
     t = src.get('title', '')
     if t and "Unknown" not in t: return t
@@ -200,88 +450,176 @@ def get_meta_safe(src):
     return "Unknown Title"
 
 def extract_titles(text):
+    prompt = f"Extract academic titles as JSON list. Text: {text[:3000]}"
+    # 同一期目录常被多个来源重复推送，正文前段相同即复用
+    key = llm_key(LLM_MODEL_NAME, prompt, 0.1)
+    hit = LLM_CACHE.get(key)
+    if hit: return hit
     logger.info("    🧠 [智能提取] 提取标题...")
     try:
         res = client.chat.completions.create(
             model=LLM_MODEL_NAME, 
-            messages=[{"role": "user", "content": f"Extract academic titles as JSON list. Text: {text[:3000]}"}], temperature=0.1
+            messages=[{"role": "user", "content": prompt}], temperature=0.1
         )
-        return json.loads(res.choices[0].message.content.strip().replace("```json", "").replace("```", "").strip())
+        out = json.loads(res.choices[0].message.content.strip().replace("```json", "").replace("```", "").strip())
+        if out and isinstance(out, list): LLM_CACHE.set(key, out)
+        return out
     except: return []
 
+def crossref_get(path="", **params):
+    """Crossref 请求走全局 Session 连接池复用 TLS；mailto 进礼貌池"""
+    r = session.get(CROSSREF_API + path, params={**params, "mailto": CONTACT_EMAIL}, headers=_CROSSREF_HEADERS, timeout=20)
+    r.raise_for_status()
+    return r.json()
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=20))
 def search_doi(title):
+    key = f"crossref:title:{' '.join(title.lower().split())}"
+    hit = API_CACHE.get(key)
+    if hit: return tuple(hit)
     logger.info(f"    🔍 [Crossref] {title[:20]}...")
-    res = cr.works(query=title, limit=1)
+    res = crossref_get(query=title, rows=1)
+    out = [None, None]
     if res['message']['items']:
         it = res['message']['items'][0]
-        return it.get('DOI'), it.get('title', [title])[0]
-    return None, None
+        out = [it.get('DOI'), it.get('title', [title])[0]]
+    API_CACHE.set(key, out, None if out[0] else NEG_CACHE_DAYS * 86400)  # 查无结果也缓存，但过期更快
+    return tuple(out)
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=4, max=10))
 def get_oa_link(doi):
+    key = f"unpaywall:{doi}"
+    hit = API_CACHE.get(key, _MISS)
+    if hit is not _MISS: return hit
     try:
-        r = requests.get(f"https://api.unpaywall.org/v2/{doi}?email=bot@example.com", timeout=10)
+        r = session.get(f"https://api.unpaywall.org/v2/{doi}", params={"email": CONTACT_EMAIL}, timeout=10)
         if r.status_code == 200:
             d = r.json()
-            if d.get('is_oa') and d.get('best_oa_location'): return d['best_oa_location']['url_for_pdf']
+            link = d['best_oa_location']['url_for_pdf'] if d.get('is_oa') and d.get('best_oa_location') else None
+            API_CACHE.set(key, link)  # 非 OA 也缓存；网络异常不缓存
+            return link
+        if r.status_code == 404: API_CACHE.set(key, None, NEG_CACHE_DAYS * 86400)  # Unpaywall 未收录，过期更快
     except: pass
     return None
 
+def html_to_text(tree):
+    """去掉 script/style 后取 body 文本，免得样式表和脚本混进正文与提示词"""
+    tree.strip_tags(['script', 'style', 'noscript'])
+    return (tree.body or tree).text(separator=' ')
+
 def extract_body_urls(msg):
-    text = ""
+    parts = []
     urls = set()
-    def grep_url(t): return [u.rstrip('.,;)]}') for u in re.findall(r'(https?://[^\s"\'<>]+)', t)]
-    if msg.is_multipart():
-        for p in msg.walk():
-            try:
-                payload = p.get_payload(decode=True)
-                if not payload: continue
-                pt = payload.decode(errors='ignore')
-                if p.get_content_type() == "text/html":
-                    urls.update(re.findall(r'href=["\']([^"\']+)["\']', pt, re.IGNORECASE))
-                    text += re.sub('<[^<]+?>', ' ', pt) + "\n"
-                else: text += pt + "\n"
-                urls.update(grep_url(pt))
-            except: continue
-    else:
+    def grep_url(t): return [u.rstrip('.,;)]}') for u in _URL_RE.findall(t)]
+    for p in msg.walk():  # 非 multipart 时 walk 只产出自身
+        if p.get_content_maintype() != "text": continue  # 跳过容器与二进制附件
         try:
-            pt = msg.get_payload(decode=True).decode(errors='ignore')
-            text += pt
+            # policy.default 下 get_content 自动处理传输编码与字符集；未知字符集回退 UTF-8
+            try: pt = p.get_content()
+            except LookupError: pt = (p.get_payload(decode=True) or b"").decode('utf-8', errors='replace')
+            if not pt: continue
+            if p.get_content_type() == "text/html":
+                # 链接取自解析后的 href（实体已解码），裸链接只在去标签后的正文里找
+                tree = LexborHTMLParser(pt)
+                urls.update(filter(None, (a.attributes.get('href') for a in tree.css('a[href]'))))
+                pt = html_to_text(tree)  # 同一棵 DOM 取正文，实体一并解码
+            parts.append(pt)
             urls.update(grep_url(pt))
-        except: pass
-    return text, list(urls)
+        except: continue
+    return "\n".join(parts), list(urls)
+
+def safe_oa_link(doi):
+    try: return get_oa_link(doi)
+    except: return None
+
+def title_source(title):
+    """标题 → Crossref DOI → Unpaywall OA 链接；查不到返回 None"""
+    try: doi, _ = search_doi(title)
+    except: return None
+    return {"type": "doi", "id": doi, "url": safe_oa_link(doi)} if doi else None
 
 def detect_sources(text, urls):
     srcs = []
     seen = set()
-    for m in re.finditer(r"(?:arXiv:|arxiv\.org/abs/|arxiv\.org/pdf/)\s*(\d{4}\.\d{4,5})", text, re.I):
-        if m.group(1) not in seen:
-            srcs.append({"type": "arxiv", "id": m.group(1), "url": f"https://arxiv.org/pdf/{m.group(1)}.pdf"})
-            seen.add(m.group(1))
-    for m in re.finditer(r"(?:doi:|doi\.org/)\s*(10\.\d{4,9}/[-._;()/:A-Z0-9]+)", text, re.I):
-        doi = m.group(1)
-        if doi not in seen:
-            try: link = get_oa_link(doi)
-            except: link = None
-            srcs.append({"type": "doi", "id": doi, "url": link})
-            seen.add(doi)
+    for m in _ID_RE.finditer(text):
+        kind, sid = m.lastgroup, m.group(m.lastgroup)
+        if sid in seen: continue
+        seen.add(sid)
+        if kind == "arxiv":
+            srcs.append({"type": "arxiv", "id": sid, "url": f"https://arxiv.org/pdf/{sid}.pdf"})
+        else:
+            srcs.append({"type": "doi", "id": sid, "url": None})
     for link in urls:
         try:
             clink = clean_google_url(link)
             if not clink: continue
             lower = clink.lower()
-            if any(x in lower for x in ['unsubscribe', 'twitter', 'facebook']): continue
-            if lower.endswith('.pdf') or 'viewcontent.cgi' in lower:
-                lid = hashlib.md5(clink.encode()).hexdigest()[:10]
+            # 先做廉价的 PDF 形态判断，绝大多数普通链接到此即止
+            if (lower.endswith('.pdf') or 'viewcontent.cgi' in lower) and not _BLOCK_RE.search(lower):
+                # 链接本身就是已识别的 arXiv/DOI 时跳过（正则取 ID 查集合，不做逐个子串扫描）
+                m = _ID_RE.search(clink)
+                if m and m.group(m.lastgroup) in seen: continue
+                lid = url_hash(clink)
                 if lid not in seen:
                     srcs.append({"type": "pdf_link", "id": f"link_{lid}", "url": clink})
                     seen.add(lid)
         except: continue
+    # 🟢 DOI 的 OA 链接并发查询，K 个 DOI 只花约一次往返
+    dois = [x for x in srcs if x["type"] == "doi"]
+    if dois:
+        with ThreadPoolExecutor(max_workers=min(OA_WORKERS, len(dois))) as ex:
+            for x, link in zip(dois, ex.map(safe_oa_link, [x["id"] for x in dois])): x["url"] = link
     return srcs
 
+def pdf_pool():
+    # MuPDF 非线程安全且吃 CPU，交给子进程池并行解析；spawn 避免在多线程中 fork
+    global _PDF_POOL
+    with _PDF_LOCK:
+        if _PDF_POOL is None:
+            _PDF_POOL = ProcessPoolExecutor(PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _PDF_POOL
+
+def probe_pdf(fp):
+    """轻量校验：只读 xref，能打开且有页即可；扫描版/图片封面首页没有文字，不按文字量判断"""
+    with pymupdf.open(fp) as doc:
+        return doc.page_count > 0
+
+def check_pdf(fp):
+    """下载后校验 PDF 是否可用，整本转换留给分析线程；不可用则删除文件并返回 False"""
+    try: ok = pdf_pool().submit(probe_pdf, fp).result()
+    except Exception: ok = False
+    if not ok: os.remove(fp)
+    return ok
+
+def file_digest(fp):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fp, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""): h.update(chunk)
+    return h.hexdigest()
+
+def pdf_to_markdown(fp):
+    # 🟢 解析结果按 PDF 内容哈希缓存：同一文件换了 ID / 重新下载都不必再解析
+    md = os.path.join(MD_CACHE_DIR, file_digest(fp) + ".md")
+    try:
+        with open(md, encoding="utf-8") as f: txt = f.read()
+        os.utime(md)  # 续期，免被过期清理
+        return txt
+    except OSError: pass
+    txt = pdf_pool().submit(pymupdf4llm.to_markdown, fp).result()
+    try:
+        os.makedirs(MD_CACHE_DIR, exist_ok=True)
+        tmp = f"{md}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: f.write(txt)
+        os.replace(tmp, md)
+    except OSError as e: logger.warning(f"    ⚠️ Markdown 缓存写入失败: {e}")
+    return txt
+
+@atexit.register
+def _close_pdf_pool():
+    if _PDF_POOL: _PDF_POOL.shutdown(wait=False, cancel_futures=True)
+
 def get_path(pid):
-    safe = re.sub(r'[\\/*?:"<>|]', '_', pid)
+    safe = _UNSAFE_FN_RE.sub('_', pid)
     return os.path.join(DOWNLOAD_DIR, f"{safe}.pdf")
 
 def sniff_real_pdf_link(initial_url, html_content):
@@ -315,90 +653,172 @@ def sniff_real_pdf_link(initial_url, html_content):
         logger.warning(f"    ⚠️ 嗅探失败: {e}")
     return None
 
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=10))
+def fetch_arxiv_abstract(item):
+    """arXiv 官方 export API 取标题+摘要 (Atom XML，几十 KB)，PDF 过大或下载失败时兜底"""
+    key = f"arxiv:abs:{item['id']}"
+    hit = API_CACHE.get(key)
+    if hit: return hit, "ABSTRACT_ONLY", None
+    polite_wait(ARXIV_API)
+    r = session.get(ARXIV_API, params={"id_list": item["id"]}, timeout=15)
+    r.raise_for_status()
+    entry = ET.fromstring(r.content).find(f"{_ATOM}entry")
+    if entry is None or entry.find(f"{_ATOM}summary") is None: return None, "ARXIV_NOT_FOUND", None
+    t = " ".join((entry.findtext(f"{_ATOM}title") or "").split())
+    a = " ".join(entry.findtext(f"{_ATOM}summary").split())
+    txt = f"TITLE: {t}\n\nABSTRACT: {a}"
+    API_CACHE.set(key, txt)
+    return txt, "ABSTRACT_ONLY", None
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=2, max=10))
 def fetch_abstract(item):
+    if item.get("type") == "arxiv":
+        # arXiv 自带重试，失败不抛出，免得外层再叠一轮重试
+        try: return fetch_arxiv_abstract(item)
+        except Exception as e: return None, f"ARXIV_ERROR: {e}", None
+    key = f"crossref:works:{item['id']}"
+    hit = API_CACHE.get(key, _MISS)
+    if hit is None: return None, "DOI_NOT_FOUND", None
+    if hit is not _MISS: return hit, "ABSTRACT_ONLY", None
     try:
-        w = cr.works(ids=item["id"])
+        w = crossref_get("/" + quote(item["id"], safe="/"))
         t = w['message'].get('title', [''])[0]
-        a = re.sub(r'<[^>]+>', '', w['message'].get('abstract', '无摘要'))
-        return f"TITLE: {t}\n\nABSTRACT: {a}", "ABSTRACT_ONLY", None
+        a = LexborHTMLParser(w['message'].get('abstract', '无摘要')).text()
+        txt = f"TITLE: {t}\n\nABSTRACT: {a}"
+        API_CACHE.set(key, txt)
+        return txt, "ABSTRACT_ONLY", None
     except requests.exceptions.HTTPError as e:
         # ✅ 核心修复：直接拦截404，不让它无限重试导致崩溃
         if e.response is not None and e.response.status_code == 404:
             logger.warning(f"    ⚠️ [Crossref] DOI 暂未收录(404)，跳过: {item['id']}")
+            API_CACHE.set(key, None, NEG_CACHE_DAYS * 86400)  # 新 DOI 可能稍后收录，短期内不再重查
             return None, "DOI_NOT_FOUND", None
         raise e
 
+def save_stream(r, fp):
+    """边下边写，返回写入字节数（免去事后 stat）；超过 MAX_PDF_BYTES 即中止
+    先写 .part，下完才改名：中途断流不会留下被当作已下载复用的残缺文件"""
+    if int(r.headers.get('Content-Length') or 0) > MAX_PDF_BYTES: raise ValueError("Too Large")
+    size, tmp = 0, fp + ".part"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in r.iter_content(64 * 1024):
+                size += f.write(chunk)
+                if size > MAX_PDF_BYTES: raise ValueError("Too Large")
+        os.replace(tmp, fp)
+        return size
+    finally:
+        try: os.remove(tmp)
+        except OSError: pass
+
+def read_capped(r, cap=MAX_HTML_BYTES):
+    """流式读取至多 cap 字节再一次性解码；r.text 会读完整个页面，无字符集时还要跑编码探测"""
+    buf = bytearray()
+    for chunk in r.iter_content(64 * 1024):
+        buf += chunk
+        if len(buf) >= cap: break
+    return buf[:cap].decode(r.encoding or 'utf-8', errors='replace')
+
+def cleanup_older_than(folder, days):
+    cutoff = time.time() - days * 86400
+    try:
+        with os.scandir(folder) as it:
+            for e in it:
+                if e.is_file() and e.stat().st_mtime < cutoff: os.remove(e.path)
+    except Exception as e: logger.warning(f"    ⚠️ 清理下载目录失败: {e}")
+
 def fetch_content(item):
     try: # ✅ 添加最外层保护，防止未知报错溢出
+        # 🟢 上次已下载过的 PDF 校验后复用，坏文件由 check_pdf 删除后重新下载
+        fp = get_path(item['id'])
+        try:
+            if os.stat(fp).st_size > 2000 and check_pdf(fp): return None, "PDF", fp
+        except OSError: pass
+
         url = clean_google_url(item.get('url'))
         if not url:
-            if item.get("type") == "doi":
+            if item.get("type") in ("doi", "arxiv"):
                 try: return fetch_abstract(item)
                 except Exception as ex: return None, str(ex), None
             return None, "No URL", None
         
         logger.info(f"    🔍 [下载] {url[:40]}...")
-        r = session.get(url, timeout=30, stream=True, allow_redirects=True)
-        if r.status_code == 429: return None, "Rate Limit", None
-        
-        final_url = r.url
-        ct = r.headers.get('Content-Type', '').lower()
+        # 校验 PDF 放在连接/域名名额释放之后，不占着下载槽位
+        real_pdf_url = None
+        with domain_slot(url), session.get(url, timeout=30, stream=True, allow_redirects=True) as r:
+            if r.status_code == 429: return None, "Rate Limit", None
+            
+            final_url = r.url
+            ct = r.headers.get('Content-Type', '').lower()
+            is_pdf = 'application/pdf' in ct or final_url.lower().endswith('.pdf')
+            if is_pdf: size = save_stream(r, fp)
+            else:
+                logger.info("    🕵️ 这是一个网页，尝试嗅探 PDF 链接...")
+                real_pdf_url = sniff_real_pdf_link(final_url, read_capped(r))
         
-        if 'application/pdf' in ct or final_url.lower().endswith('.pdf'):
-            fp = get_path(item['id'])
-            with open(fp, "wb") as f:
-                for chunk in r.iter_content(8192): f.write(chunk)
-            if os.path.getsize(fp) < 2000:
+        if is_pdf:
+            if size < 2000:
                 os.remove(fp)
                 return None, "Too Small", None
-            return pymupdf4llm.to_markdown(fp), "PDF", fp
+            # 打不开的 PDF 与没下到一样，走下面的摘要兜底
+            if check_pdf(fp): return None, "PDF", fp
             
-        else:
-            logger.info("    🕵️ 这是一个网页，尝试嗅探 PDF 链接...")
-            html_text = r.text
-            real_pdf_url = sniff_real_pdf_link(final_url, html_text)
-            
-            if real_pdf_url:
-                logger.info(f"    🚀 嗅探成功，二次下载: {real_pdf_url[:40]}...")
-                r2 = session.get(real_pdf_url, timeout=30, stream=True)
-                if 'application/pdf' in r2.headers.get('Content-Type', '').lower():
-                    fp = get_path(item['id'])
-                    with open(fp, "wb") as f:
-                        for chunk in r2.iter_content(8192): f.write(chunk)
-                    if os.path.getsize(fp) > 2000:
-                        return pymupdf4llm.to_markdown(fp), "PDF", fp
-            
-            logger.info("    ⚠️ 无法下载 PDF，转为摘要分析")
-            if item.get("type") == "doi":
-                try: return fetch_abstract(item)
-                except Exception as ex: return None, str(ex), None
-            return None, "Not PDF", None
+        if real_pdf_url:
+            logger.info(f"    🚀 嗅探成功，二次下载: {real_pdf_url[:40]}...")
+            with domain_slot(real_pdf_url), session.get(real_pdf_url, timeout=30, stream=True) as r2:
+                ok = 'application/pdf' in r2.headers.get('Content-Type', '').lower() and save_stream(r2, fp) > 2000
+            if ok and check_pdf(fp): return None, "PDF", fp
+        
+        logger.info("    ⚠️ 无法下载 PDF，转为摘要分析")
+        if item.get("type") in ("doi", "arxiv"):
+            try: return fetch_abstract(item)
+            except Exception as ex: return None, str(ex), None
+        return None, "Not PDF", None
 
     except Exception as e:
-        if item.get("type") == "doi":
+        if item.get("type") in ("doi", "arxiv"):
             try: return fetch_abstract(item)
             except Exception as ex: return None, str(ex), None
         return None, str(e), None
 
+def strip_back_matter(txt):
+    """截掉参考文献/致谢/附录等尾部章节，把截断额度留给正文"""
+    m = _BACKMATTER_RE.search(txt, len(txt) // 3)  # 前 1/3 出现的多半是目录
+    return txt[:m.start()] if m else txt
+
+def trim_for_llm(txt, limit=45000):
+    """去尾部章节，再删掉逐页重复的短行（页眉页脚、期刊名、版权声明、分页线），最后截断"""
+    txt = strip_back_matter(txt)
+    lines = txt.splitlines()
+    cnt = Counter(l.strip() for l in lines)
+    # 表格行以 | 开头，重复也保留
+    noise = {l for l, n in cnt.items() if n >= 3 and l and len(l) < 100 and not l.startswith('|')}
+    if noise: txt = "\n".join(l for l in lines if l.strip() not in noise)
+    return txt[:limit]
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=5, max=30))
 def analyze(txt, ctype):
     if ctype == "ABSTRACT_ONLY":
         title_part = "Unknown"
         abstract_part = txt
-        m = re.search(r"TITLE:\s*(.*?)\n\nABSTRACT:\s*(.*)", txt, re.DOTALL)
+        m = _ABSTRACT_RE.search(txt)
         if m:
             title_part = m.group(1).strip()
             abstract_part = m.group(2).strip()
             
         sys_prompt = "你是一个专业的学术翻译助手。"
         user_prompt = f"请将以下学术摘要翻译成通顺的中文（仅输出翻译内容，不要任何前缀）：\n\n{abstract_part}"
+        key = llm_key(LLM_MODEL_NAME, sys_prompt, user_prompt, 0.3, title_part)
+        hit = LLM_CACHE.get(key)
+        if hit: return tuple(hit)
         try:
             res = client.chat.completions.create(
                 model=LLM_MODEL_NAME, messages=[{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}], temperature=0.3
             )
             trans = res.choices[0].message.content.strip()
-            return title_part, f"**【摘要翻译】**\n\n{trans}"
+            out = [title_part, f"**【摘要翻译】**\n\n{trans}"]
+            LLM_CACHE.set(key, out)
+            return tuple(out)
         except:
             return title_part, f"摘要翻译失败。原文：\n{abstract_part[:500]}..."
 
@@ -426,8 +846,9 @@ def analyze(txt, ctype):
 
     类型: {ctype}
     内容: 
-    {txt[:45000]}
+    {trim_for_llm(txt)}
     """
+    # 全文分析不进 LLM_CACHE：分析成功即标记 ANALYZED 不会再请求，缓存只会让提交的 data/ 越来越大
     res = client.chat.completions.create(
         model=LLM_MODEL_NAME,
         messages=[{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}],
@@ -442,22 +863,54 @@ def analyze(txt, ctype):
     
     title = "Unknown"
     body = clean
-    m = re.search(r"TITLE:\s*(.*)", clean, re.I)
+    m = _TITLE_RE.search(clean)
     if m:
         title = m.group(1).strip()
         body = clean.replace(m.group(0), "").strip()
     return title, body
 
+HTML_TAG_STYLES = {
+    "h3": '<h3 style="color:#2c3e50; border-bottom:2px solid #3498db; padding-bottom:8px; margin-top:20px;">',
+    "strong": '<strong style="background-color:#fff3cd; padding:0 4px; border-radius:3px; color:#333;">',
+    "ul": '<ul style="padding-left:20px; color:#444; line-height:1.6;">',
+    "li": '<li style="margin-bottom:5px;">',
+    "p": '<p style="margin:10px 0; line-height:1.6; color:#333;">',
+}
+_STYLE_TAG_RE = re.compile(r'<(h3|strong|ul|li|p)>')  # 一遍替换全部内联样式
+
+# mistune 比 python-markdown 快一个量级；hard_wrap 对应原 nl2br，插件覆盖 extra 里用到的表格/脚注
+_MD = mistune.create_markdown(escape=False, hard_wrap=True, plugins=['table', 'strikethrough', 'footnotes', 'def_list'])
+
 def md_to_styled_html(md_text):
-    html = markdown.markdown(md_text, extensions=['extra', 'nl2br'])
-    html = re.sub(r'<h3>', '<h3 style="color:#2c3e50; border-bottom:2px solid #3498db; padding-bottom:8px; margin-top:20px;">', html)
-    html = re.sub(r'<strong>', '<strong style="background-color:#fff3cd; padding:0 4px; border-radius:3px; color:#333;">', html)
-    html = re.sub(r'<ul>', '<ul style="padding-left:20px; color:#444; line-height:1.6;">', html)
-    html = re.sub(r'<li>', '<li style="margin-bottom:5px;">', html)
-    html = re.sub(r'<p>', '<p style="margin:10px 0; line-height:1.6; color:#333;">', html)
-    return html
-
-def send_mail(subj, md_content, files=[]):
+    html = _MD(md_text)
+    return _STYLE_TAG_RE.sub(lambda m: HTML_TAG_STYLES[m.group(1)], html)
+
+class SmtpSession:
+    """批量发信共用一个 SMTP_SSL 连接，掉线时重连一次"""
+    def __enter__(self):
+        self.s = self._connect()
+        return self
+
+    def _connect(self):
+        s = smtplib.SMTP_SSL(SMTP_SERVER, 465, context=_SSL_CTX)
+        s.login(EMAIL_USER, EMAIL_PASS)
+        return s
+
+    def send(self, msg):
+        # 空闲过久的连接 NOOP 可能抛断线、SSL/套接字错误，或回 421 等非 250：都重连一次
+        try: ok = self.s.noop()[0] == 250
+        except (smtplib.SMTPException, OSError): ok = False
+        if not ok:
+            try: self.s.close()
+            except: pass
+            self.s = self._connect()
+        self.s.send_message(msg)
+
+    def __exit__(self, *exc):
+        try: self.s.quit()
+        except: pass
+
+def send_mail(subj, md_content, files=[], smtp=None):
     styled_body = md_to_styled_html(md_content)
     full_html = f"""
     <!DOCTYPE html>
@@ -477,36 +930,236 @@ def send_mail(subj, md_content, files=[]):
     </html>
     """
     
-    msg = MIMEMultipart()
+    msg = EmailMessage()
     msg["Subject"] = subj
     msg["From"] = EMAIL_USER
     msg["To"] = EMAIL_USER
-    msg.attach(MIMEText(full_html, "html", "utf-8"))
+    msg.set_content(full_html, subtype="html")
     
     for f in files:
-        if os.path.exists(f):
-            try:
-                with open(f, "rb") as fp:
-                    part = MIMEApplication(fp.read(), Name=os.path.basename(f))
-                    part['Content-Disposition'] = f'attachment; filename="{os.path.basename(f)}"'
-                    msg.attach(part)
-            except: pass
+        try:
+            # 附件可为路径，或内存中的 (文件名, 字节)
+            if isinstance(f, tuple): name, data = f
+            elif os.path.exists(f):
+                name = os.path.basename(f)
+                with open(f, "rb") as fp: data = fp.read()
+            else: continue
+            maintype, subtype = (mimetypes.guess_type(name)[0] or "application/octet-stream").split("/", 1)
+            msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=name)
+        except: pass
             
     try:
-        with smtplib.SMTP_SSL(SMTP_SERVER, 465) as s:
-            s.login(EMAIL_USER, EMAIL_PASS)
-            s.sendmail(EMAIL_USER, EMAIL_USER, msg.as_string())
+        # send_message 经 BytesGenerator 直接序列化为字节，省去 as_string 的整份拷贝
+        if smtp: smtp.send(msg)
+        else:
+            with SmtpSession() as s: s.send(msg)
         logger.info(f"✅ 邮件已发送: {subj}")
         return True
     except Exception as e:
         logger.error(f"邮件失败: {e}")
         return False
 
+def pack_zip(files):
+    """在内存中打包（超过上限才溢写临时文件），返回 zip 字节"""
+    with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as buf:
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED, compresslevel=3) as z:
+            for f in files:
+                ct = zipfile.ZIP_STORED if os.path.splitext(f)[1].lower() in STORED_EXTS else zipfile.ZIP_DEFLATED
+                z.write(f, os.path.basename(f), compress_type=ct)
+        buf.seek(0)
+        return buf.read()
+
+# --- IMAP ---
+def connect_imap():
+    """复用已登录的 IMAP 连接，NOOP 探活失败则重连"""
+    key = (IMAP_SERVER, EMAIL_USER)
+    m = _IMAP_POOL.get(key)
+    if m:
+        try:
+            m.noop()
+            return m
+        except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError):
+            _IMAP_POOL.pop(key, None)
+    m = imaplib.IMAP4_SSL(IMAP_SERVER, ssl_context=_SSL_CTX)
+    m.login(EMAIL_USER, EMAIL_PASS)
+    _IMAP_POOL[key] = m
+    return m
+
+def imap_idle_wait(m, timeout):
+    """发 IDLE 并等待，收到 EXISTS（新邮件）返回 True，超时返回 False；imaplib (3.9) 没有 IDLE，直接收发原始行"""
+    tag = b"IDLE%d" % next(_IDLE_TAGS)
+    buf = bytearray()
+
+    def read_line(deadline):
+        # 不走 imaplib 的 m.file：其缓冲里已读入的行 select/超时都看不到，"+ idling" 与 EXISTS 可能同包到达
+        while b"\n" not in buf:
+            left = deadline - time.monotonic()
+            if left <= 0: return None
+            m.sock.settimeout(left)
+            try: chunk = m.sock.recv(65536)
+            except socket.timeout: return None
+            if not chunk: raise imaplib.IMAP4.abort("IDLE: connection closed")
+            buf.extend(chunk)
+        i = buf.index(b"\n") + 1
+        line = bytes(buf[:i]); del buf[:i]
+        return line
+
+    old = m.sock.gettimeout()
+    try:
+        m.send(tag + b" IDLE\r\n")
+        line = read_line(time.monotonic() + 30)
+        if not line or not line.startswith(b"+"): raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+        got, deadline = False, time.monotonic() + timeout
+        while not got:
+            line = read_line(deadline)
+            if line is None: break
+            got = bool(_IMAP_EXISTS_RE.match(line))
+        m.send(b"DONE\r\n")
+        # DONE 之前刚到的 EXISTS 也算数
+        end = time.monotonic() + 30
+        while True:
+            line = read_line(end)
+            if line is None: raise imaplib.IMAP4.abort("IDLE: no reply to DONE")
+            if line.startswith(tag + b" "): return got
+            got = got or bool(_IMAP_EXISTS_RE.match(line))
+    finally: m.sock.settimeout(old)
+
+def wait_for_mail(seconds):
+    """调度模式：IDLE 等新邮件，有推送即提前开跑；服务器不支持或出错则退回定时等待"""
+    deadline = time.monotonic() + seconds
+    try:
+        m = connect_imap()
+        if "IDLE" not in m.capabilities: raise imaplib.IMAP4.error("IDLE not supported")
+        m.select("inbox")
+        while deadline - time.monotonic() > 0:
+            if imap_idle_wait(m, min(deadline - time.monotonic(), IDLE_REFRESH)):
+                logger.info("📬 收到新邮件推送")
+                return
+    except Exception as e:
+        logger.warning(f"⚠️ IDLE 不可用，改为定时轮询: {e}")
+        _close_imap_pool()
+        time.sleep(max(0, deadline - time.monotonic()))
+
+@atexit.register
+def _close_imap_pool():
+    for m in _IMAP_POOL.values():
+        try: m.logout()
+        except: pass
+    _IMAP_POOL.clear()
+
+def imap_fetch_batch(m, ids, spec, sizes=None):
+    """按 IMAP_FETCH_CHUNK 分批 FETCH，返回 {eid: raw_bytes}；传入 sizes 时顺带收集 RFC822.SIZE"""
+    res = {}
+    for i in range(0, len(ids), IMAP_FETCH_CHUNK):
+        typ, data = m.fetch(b",".join(ids[i:i+IMAP_FETCH_CHUNK]), spec)
+        # 失败的这批不放进结果，由调用方按缺失处理（不推进 UID 游标）
+        if typ != "OK":
+            logger.warning(f"⚠️ IMAP FETCH 失败: {typ} {data}")
+            continue
+        eid = None
+        for part in data or []:
+            if isinstance(part, tuple):
+                eid = part[0].split()[0]
+                res[eid] = part[1]
+                head = part[0]
+            elif eid is not None and isinstance(part, bytes): head = part  # 字面量之后的剩余部分，如 b' RFC822.SIZE 123)'
+            else: continue
+            if sizes is not None and eid not in sizes:
+                # 服务器可能把 RFC822.SIZE 放在字面量前或后
+                sz = _IMAP_SIZE_RE.search(head)
+                if sz: sizes[eid] = int(sz.group(1))
+    return res
+
+def parse_sexp(raw):
+    """IMAP 括号表达式 → 嵌套 list（字符串去引号，NIL 为 None）"""
+    stack = [[]]
+    for t in _SEXP_TOKEN_RE.findall(raw):
+        if t == b"(": stack.append([])
+        elif t == b")":
+            if len(stack) > 1: x = stack.pop(); stack[-1].append(x)
+        elif t.startswith(b'"'): stack[-1].append(t[1:-1].replace(b'\\"', b'"').decode(errors="replace"))
+        else: stack[-1].append(None if t.upper() == b"NIL" else t.decode(errors="replace"))
+    return stack[0]
+
+def text_parts(bs, num=""):
+    """遍历 BODYSTRUCTURE，返回 [(段号, 子类型, 字符集, 传输编码)]，只要 text/plain 与 text/html"""
+    if bs and isinstance(bs[0], list):  # multipart：开头连续的 list 才是子段
+        out = []
+        for i, sub in enumerate(itertools.takewhile(lambda x: isinstance(x, list), bs), 1):
+            out += text_parts(sub, f"{num}.{i}" if num else str(i))
+        return out
+    if len(bs) > 5 and str(bs[0]).lower() == "text" and str(bs[1]).lower() in ("plain", "html"):
+        params = bs[2] if isinstance(bs[2], list) else []
+        cs = {str(k).lower(): v for k, v in zip(params[::2], params[1::2])}.get("charset") or "utf-8"
+        return [(num or "1", str(bs[1]).lower(), cs, bs[5] or "7bit")]
+    return []
+
+def imap_fetch_text_parts(m, eid):
+    """大邮件只取正文文本段，跳过内嵌图片与附件；拼成最小 MIME，沿用同一套解析。失败返回 None"""
+    try:
+        _, data = m.fetch(eid, "(BODYSTRUCTURE)")
+        raw = b" ".join(x if isinstance(x, bytes) else x[0] + x[1] for x in data or [] if x)
+        parts = text_parts(parse_sexp(raw[raw.index(b"BODYSTRUCTURE") + 13:])[0])
+        if not parts: return None
+        _, data = m.fetch(eid, "(" + " ".join(f"BODY.PEEK[{p[0]}]" for p in parts) + ")")
+        got = {}
+        for x in data or []:
+            if isinstance(x, tuple):
+                sec = _IMAP_SECTION_RE.search(x[0])
+                if sec: got[sec.group(1).decode()] = x[1]
+        out = [b'Content-Type: multipart/mixed; boundary="=_pb"', b""]
+        for num, sub, cs, enc in parts:
+            if num not in got: continue
+            out += [b"--=_pb", f'Content-Type: text/{sub}; charset="{cs}"'.encode(),
+                    f"Content-Transfer-Encoding: {enc}".encode(), b"", got[num]]
+        out.append(b"--=_pb--")
+        return b"\r\n".join(out)
+    except Exception as e:
+        logger.warning(f"    ⚠️ 分段取信失败，回退整封: {e}")
+        return None
+
+def imap_select(m, box="inbox"):
+    """SELECT 并从其响应码取 {'UIDNEXT': n, 'UIDVALIDITY': v}；
+    不用 STATUS：调度模式下池里的连接仍选中着收件箱，对已选中邮箱发 STATUS 可能拿到过期的 UIDNEXT"""
+    m.select(box)  # select 会清空旧的 untagged_responses
+    st = {}
+    for k in ("UIDNEXT", "UIDVALIDITY"):
+        try: st[k] = int(m.response(k)[1][-1])
+        except: pass
+    return st if len(st) == 2 else {}
+
+def imap_search_subjects(m, since, uid_from=None):
+    """服务端按主题关键词过滤，客户端 _SUBJECT_RE 仅作兜底；出错回退为只按日期搜索"""
+    base = f'SINCE "{since}"' + (f' UID {uid_from}:*' if uid_from else '')
+    try:
+        ids = set()
+        kws = [k for k in TARGET_SUBJECTS if k.isascii()]
+        if kws:
+            # IMAP 的 OR 是二元的，需逐层嵌套
+            crit = functools.reduce(lambda acc, k: f'OR SUBJECT "{k}" {acc}', kws[1:], f'SUBJECT "{kws[0]}"')
+            typ, data = m.search(None, f'({base} {crit})')
+            if typ != "OK": raise imaplib.IMAP4.error(typ)
+            ids.update(data[0].split())
+        # 非 ASCII 关键词需以 UTF-8 literal 发送，imaplib 每条命令只支持一个 literal
+        for k in TARGET_SUBJECTS:
+            if k.isascii(): continue
+            m.literal = k.encode()
+            typ, data = m.search("UTF-8", base, "SUBJECT")
+            if typ != "OK": raise imaplib.IMAP4.error(typ)
+            ids.update(data[0].split())
+        return sorted(ids, key=int)
+    except imaplib.IMAP4.error as e:
+        logger.warning(f"⚠️ 服务端主题过滤失败，回退按日期搜索: {e}")
+        _, data = m.search(None, f'({base})')
+        return data[0].split() if data[0] else []
+
 # --- 入口 ---
 def run():
     startup_check()
     logger.info(f"🎬 任务开始")
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    cleanup_older_than(DOWNLOAD_DIR, DOWNLOAD_KEEP_DAYS)
+    cleanup_older_than(MD_CACHE_DIR, DOWNLOAD_KEEP_DAYS)
     os.makedirs(DATA_DIR, exist_ok=True)
     
     email_db = EmailHistory(EMAIL_RECORD_FILE)
@@ -518,89 +1171,89 @@ def run():
 
     # 1. 扫描
     try:
-        m = imaplib.IMAP4_SSL(IMAP_SERVER)
-        m.login(EMAIL_USER, EMAIL_PASS)
-        m.select("inbox")
-        _, data = m.search(None, f'(SINCE "{(datetime.date.today()-timedelta(days=2)).strftime("%d-%b-%Y")}")')
-        if data[0]:
-            for eid in data[0].split():
+        m = connect_imap()
+        # 🟢 增量：UIDVALIDITY 未变时只搜上轮 UIDNEXT 之后的新邮件
+        st = imap_select(m)
+        try: prev = json_read(IMAP_STATE_FILE)
+        except: prev = {}
+        uid_from = prev.get("UIDNEXT") if st and prev.get("UIDVALIDITY") == st.get("UIDVALIDITY") else None
+        # UIDNEXT 未变即无新邮件；此时 UID n:* 仍会匹配最新一封，直接跳过搜索
+        if uid_from and uid_from == st["UIDNEXT"]: ids = []
+        else: ids = imap_search_subjects(m, (datetime.date.today()-timedelta(days=2)).strftime("%d-%b-%Y"), uid_from)
+        scan_ok = True
+        # 🟢 第一轮：只取头部，批量过滤
+        sizes = {}
+        headers = imap_fetch_batch(m, ids, '(RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT)])', sizes)
+        hits = {}
+        for eid in ids:
+            try:
+                # 头部没取到的邮件无从判断，本轮不推进游标，下轮重搜
+                if eid not in headers: scan_ok = False; continue
+                hdr = _HDR_PARSER.parsebytes(headers[eid])
+                msg_id = (hdr.get('Message-ID') or "").strip() or f"no_id_{eid}"
+                subj = fast_subject(hdr.get('Subject') or "Unknown")
+
+                if email_db.exists(msg_id): continue
+                if not _SUBJECT_RE.search(subj): continue
+                hits[eid] = (msg_id, subj)
+            except: scan_ok = False
+
+        # 🟢 第二轮：仅对命中邮件批量取正文 (PEEK 不标记已读)
+        # 大邮件（多为内嵌图片/附件）按 BODYSTRUCTURE 只取文本段
+        bodies, full = {}, []
+        for eid in hits:
+            raw = imap_fetch_text_parts(m, eid) if sizes.get(eid, 0) > IMAP_FULL_FETCH_MAX else None
+            if raw: bodies[eid] = raw
+            else: full.append(eid)
+        bodies.update(imap_fetch_batch(m, full, "(BODY.PEEK[])"))
+        known_titles = {norm_title(v.get('real_title') or v.get('title') or '') for v in db.data.values()}
+        parsed = []
+        for eid, (msg_id, subj) in hits.items():
+            try:
+                if eid not in bodies: scan_ok = False; continue
+                logger.info(f"🎯 处理邮件: {subj[:20]}...")
+                txt, urls = extract_body_urls(_MSG_PARSER.parsebytes(bodies[eid]))
+                parsed.append((msg_id, txt, detect_sources(txt, urls)))
+            except: scan_ok = False
+
+        # 🟢 没有直接来源的邮件才需 LLM 提取标题，各封邮件的请求并发发出；入库仍按邮件顺序
+        with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as llm_ex:
+            title_futs = {i: llm_ex.submit(extract_titles, txt) for i, (_, txt, srcs) in enumerate(parsed) if not srcs}
+            for i, (msg_id, txt, srcs) in enumerate(parsed):
                 try:
-                    _, h_data = m.fetch(eid, '(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT)])')
-                    raw_header = h_data[0][1].decode()
-                    
-                    msg_id_match = re.search(r'Message-ID:\s*(<.*?>)', raw_header, re.I)
-                    msg_id = msg_id_match.group(1) if msg_id_match else f"no_id_{eid}"
-                    
-                    subj_match = re.search(r'Subject:\s*(.*)', raw_header, re.I)
-                    raw_subj = subj_match.group(1) if subj_match else "Unknown"
-                    subj = decode_header(raw_subj)[0][0]
-                    if isinstance(subj, bytes): subj = subj.decode()
-
-                    if email_db.exists(msg_id): continue
-                    if not any(k.lower() in subj.lower() for k in TARGET_SUBJECTS): continue
-                    
-                    logger.info(f"🎯 处理邮件: {subj[:20]}...")
-                    
-                    _, b = m.fetch(eid, "(RFC822)")
-                    msg = email.message_from_bytes(b[0][1])
-                    txt, urls = extract_body_urls(msg)
-                    srcs = detect_sources(txt, urls)
-                    
-                    if not srcs:
-                        ts = extract_titles(txt)
-                        for t in ts:
-                            try:
-                                doi, full = search_doi(t)
-                                if doi: srcs.append({"type": "doi", "id": doi, "url": get_oa_link(doi)})
-                            except: pass
-                            
+                    if i in title_futs:
+                        # 库里已有的标题（含本轮已查过的）不再走 Crossref
+                        ts = [t for t in title_futs[i].result() if isinstance(t, str) and norm_title(t) not in known_titles]
+                        known_titles.update(map(norm_title, ts))
+                        if ts:
+                            # 各标题的 Crossref/Unpaywall 查询互不依赖，并发进行
+                            with ThreadPoolExecutor(max_workers=min(OA_WORKERS, len(ts))) as ex:
+                                srcs += [x for x in ex.map(title_source, ts) if x]
+
                     for s in srcs:
-                        pid = s.get('id') or hashlib.md5(s.get('url','').encode()).hexdigest()[:10]
+                        pid = s.get('id') or url_hash(s.get('url') or '')
                         s['id'] = pid
                         if 'title' not in s: s['title'] = get_meta_safe(s)
                         if db.add_new(pid, s): logger.info(f"    ➕ 新增: {pid}")
-                    
+
+                    db.save()  # 先落新文献，再记邮件已处理，中途崩溃也不丢
                     email_db.add(msg_id)
-                except: pass
+                except: scan_ok = False
+        # 有邮件处理失败时不推进游标，下轮仍会重新搜到
+        if scan_ok and "UIDNEXT" in st: json_write(IMAP_STATE_FILE, st)
     except Exception as e: logger.error(f"IMAP: {e}")
+    email_db.save()
+    _flush_caches()
 
-    # 2. 下载
-    pend_dl = db.get_pending_downloads(BATCH_SIZE)
-    logger.info(f"📥 待下载: {len(pend_dl)}")
-    for item in pend_dl:
-        try: # ✅ 添加循环层保护：死掉一个也不影响下一个
-            res, type_, path = fetch_content(item)
-            if type_ in ["PDF", "ABSTRACT_ONLY"]:
-                db.update_status(item['id'], "DOWNLOADED" if type_=="PDF" else "ABSTRACT_ONLY", 
-                               {"local_path": path, "content_type": type_, "abstract_content": res if type_=="ABSTRACT_ONLY" else ""})
-            else:
-                db.inc_retry(item['id'])
-                db.update_status(item['id'], "DOWNLOAD_FAILED")
-                failed_items.append({
-                    'title': item.get('title', 'Unknown Title'),
-                    'url': item.get('url', '#'),
-                    'reason': f'获取失败 ({type_})'
-                })
-        except Exception as e:
-            logger.error(f"    ❌ 处理文献 {item.get('id')} 严重崩溃: {e}")
-            db.inc_retry(item.get('id', 'unknown'))
-            db.update_status(item.get('id', 'unknown'), "DOWNLOAD_FAILED")
-            failed_items.append({
-                'title': item.get('title', 'Unknown Title'),
-                'url': item.get('url', '#'),
-                'reason': f'程序异常跳过: {str(e)[:50]}'
-            })
-
-    # 3. 分析
-    pend_an = db.get_pending_analysis(BATCH_SIZE)
-    logger.info(f"🤖 待分析: {len(pend_an)}")
-    reports, atts = [], []
+    # 🟢 下载 → 解析 → LLM 流水线：上轮遗留的待分析先入队，之后每下载完一篇立即提交分析
+    entries, atts, jobs = [], [], []
     first_sent = False
 
-    for item in pend_an:
-        try: # ✅ 分析层循环保护
+    def prepare(item):
+        """准备 (item, txt, ctype, fp)；fp 非空即 PDF，txt 留空由分析线程转换；失败时更新状态并返回 None"""
+        try: # ✅ 分析层保护
             pid = item['id']
-            txt, ctype = "", item.get("content_type", "Unknown")
+            txt, ctype, fp = "", item.get("content_type", "Unknown"), None
             
             if item["status"] == "ABSTRACT_ONLY":
                 failed_items.append({
@@ -611,44 +1264,99 @@ def run():
 
             if item["status"] == "DOWNLOADED":
                 fp = get_path(pid)
-                if not os.path.exists(fp):
+                try: fsize = os.stat(fp).st_size
+                except OSError:
                     _, ctype, fp = fetch_content(item)
                     if not fp: 
                         db.update_status(pid, "DOWNLOAD_FAILED")
-                        continue
-                try: txt = pymupdf4llm.to_markdown(fp)
-                except: db.update_status(pid, "ANALYSIS_FAILED"); continue
-                atts.append(fp)
+                        return None
+                    fsize = os.stat(fp).st_size
+                txt = ""  # 整本转换放到分析线程里做
+                atts.append((fp, fsize))
             elif item["status"] == "ABSTRACT_ONLY":
                 txt = item.get("abstract_content", "")
                 if not txt:
                     try: txt, _, _ = fetch_abstract(item)
-                    except: db.inc_retry(pid); continue
-            
-            logger.info(f"分析: {pid}")
-            rt, ans = analyze(txt, ctype)
+                    except: txt = None
+                    # DOI_NOT_FOUND 等情况返回 (None, 原因, None)，没有可分析的文本
+                    if not txt: db.inc_retry(pid); return None
+            return item, txt, ctype, fp
+        except Exception as e:
+            logger.error(f"文献分析阶段崩溃 {item.get('id', 'unknown')}: {e}")
+            db.inc_retry(item.get('id', 'unknown'))
+            db.update_status(item.get('id', 'unknown'), "ANALYSIS_FAILED")
+
+    def analyze_job(job):
+        logger.info(f"分析: {job[0]['id']}")
+        try:
+            txt = pdf_to_markdown(job[3]) if job[3] else job[1]
+            # 空文本的提示词人人相同，不发请求也不查缓存，否则会把别篇的结果套上来；在 analyze 外判断，免得被 @retry 空等
+            if not txt or not txt.strip(): raise ValueError("无可分析内容")
+            return analyze(txt, job[2]), None
+        except Exception as e: return None, e
+
+    an_ex = ThreadPoolExecutor(max_workers=ANALYZE_WORKERS)
+    def enqueue(item):
+        if len(jobs) >= BATCH_SIZE: return
+        job = prepare(item)
+        if job: jobs.append((job, an_ex.submit(analyze_job, job)))
+
+    for item in db.get_pending_analysis(BATCH_SIZE): enqueue(item)
+
+    # 2. 下载 (与分析流水线并行)
+    pend_dl = db.get_pending_downloads(BATCH_SIZE)
+    logger.info(f"📥 待下载: {len(pend_dl)}")
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+        futs = {ex.submit(fetch_content, item): item for item in pend_dl}
+        for fut in as_completed(futs):
+            item = futs[fut]
+            try: # ✅ 添加循环层保护：死掉一个也不影响下一个
+                res, type_, path = fut.result()
+                if type_ in ["PDF", "ABSTRACT_ONLY"]:
+                    db.update_status(item['id'], "DOWNLOADED" if type_=="PDF" else "ABSTRACT_ONLY", 
+                                   {"local_path": path, "content_type": type_, "abstract_content": res if type_=="ABSTRACT_ONLY" else ""})
+                    enqueue(item)
+                else:
+                    db.inc_retry(item['id'])
+                    db.update_status(item['id'], "DOWNLOAD_FAILED")
+                    failed_items.append({
+                        'title': item.get('title', 'Unknown Title'),
+                        'url': item.get('url', '#'),
+                        'reason': f'获取失败 ({type_})'
+                    })
+            except Exception as e:
+                logger.error(f"    ❌ 处理文献 {item.get('id')} 严重崩溃: {e}")
+                db.inc_retry(item.get('id', 'unknown'))
+                db.update_status(item.get('id', 'unknown'), "DOWNLOAD_FAILED")
+                failed_items.append({
+                    'title': item.get('title', 'Unknown Title'),
+                    'url': item.get('url', '#'),
+                    'reason': f'程序异常跳过: {str(e)[:50]}'
+                })
+
+    db.save()
+
+    # 3. 分析：按入队顺序收结果，报告顺序与队列一致
+    logger.info(f"🤖 待分析: {len(jobs)}")
+    for (item, txt, ctype, fp), fut in jobs:
+        try:
+            res, err = fut.result()
+            if err: raise err
+            pid = item['id']
+            rt, ans = res
             disp = rt if ("Unknown" not in rt and rt) else item.get('title', 'Unknown')
-            tt = translate_title(disp)
             badge = " (仅摘要)" if ctype == "ABSTRACT_ONLY" else ""
             
             origin_link = item.get('url', '#')
             link_html = f"🔗 [原始链接]({origin_link})"
             
-            card = f"""
-### {disp} {badge}
-> **{tt}**
-
-{link_html}
-
-{ans}
-            """
-            reports.append(card)
+            entries.append((disp, badge, link_html, ans))
             db.update_status(pid, "ANALYZED", {"real_title": disp})
 
             if not first_sent:
                 logger.info("🚀 首单即送...")
-                att_list = [fp] if (item["status"]=="DOWNLOADED" and os.path.exists(fp)) else []
-                send_mail(f"⚡ [预览] {disp}", card, att_list)
+                att_list = [fp] if fp else []
+                send_mail(f"⚡ [预览] {disp}", render_card(disp, translate_title(disp), badge, link_html, ans), att_list)
                 first_sent = True
 
         except Exception as e:
@@ -656,36 +1364,48 @@ def run():
             db.inc_retry(item.get('id', 'unknown'))
             db.update_status(item.get('id', 'unknown'), "ANALYSIS_FAILED")
 
+    an_ex.shutdown()
+    db.save()
+    _flush_caches()
+
+    # 🟢 标题统一批量翻译 (首单已单独翻译并入缓存)
+    tts = translate_titles([e[0] for e in entries])
+    reports = [render_card(d, tt, b, l, a) for (d, b, l, a), tt in zip(entries, tts)]
+
     # 4. 发送
     if reports or failed_items:
         failed_section = ""
         if failed_items:
-            failed_section = "### ⚠️ 需要手动关注的链接 (下载失败/仅摘要)\n"
-            for f in failed_items:
-                failed_section += f"- [{f['title']}]({f['url']}) - *{f['reason']}*\n"
-            failed_section += "\n---\n\n"
+            lines = [f"- [{f['title']}]({f['url']}) - *{f['reason']}*\n" for f in failed_items]
+            failed_section = "### ⚠️ 需要手动关注的链接 (下载失败/仅摘要)\n" + "".join(lines) + "\n---\n\n"
 
         if len(reports) == 1 and first_sent and not failed_items: pass
         else:
-            zips = []
-            cz, csz = [], 0
-            for f in atts:
-                s = os.path.getsize(f)
-                if csz+s > MAX_EMAIL_ZIP_SIZE: zips.append(cz); cz, csz = [f], s
-                else: cz.append(f); csz += s
-            if cz: zips.append(cz)
+            # 🟢 首次适应递减 (FFD) 装箱：大文件先放，尽量少拆几封邮件
+            bins = []
+            for f, s in sorted(atts, key=lambda a: -a[1]):
+                # 单个文件已超限：不附件，正文卡片里保留原始链接
+                if s > MAX_EMAIL_ZIP_SIZE:
+                    logger.warning(f"📎 附件过大，仅保留链接: {os.path.basename(f)}")
+                    continue
+                for b in bins:
+                    if b[1] + s <= MAX_EMAIL_ZIP_SIZE: b[0].append(f); b[1] += s; break
+                else: bins.append([[f], s])
+            zips = [b[0] for b in bins]
             
             full_md = failed_section + "\n\n---\n\n".join(reports)
             
             if not zips: send_mail(f"🤖 AI 日报 ({len(reports)})", full_md)
             else:
-                for i, zf in enumerate(zips):
-                    zn = f"p_{i+1}.zip"
-                    with zipfile.ZipFile(zn, 'w', zipfile.ZIP_DEFLATED) as z:
-                        for f in zf: z.write(f, os.path.basename(f))
-                    send_mail(f"🤖 AI 日报 ({i+1})", full_md if i==0 else "附件", [zn])
-                    if os.path.exists(zn): os.remove(zn)
-                    time.sleep(5)
+                try:
+                    # 🟢 发送第 i 包时后台打包第 i+1 包
+                    with SmtpSession() as smtp, ThreadPoolExecutor(max_workers=1) as packer:
+                        fut = packer.submit(pack_zip, zips[0])
+                        for i in range(len(zips)):
+                            data = fut.result()
+                            if i + 1 < len(zips): fut = packer.submit(pack_zip, zips[i+1])
+                            send_mail(f"🤖 AI 日报 ({i+1})", full_md if i==0 else "附件", [(f"p_{i+1}.zip", data)], smtp)
+                except Exception as e: logger.error(f"邮件失败: {e}")
     logger.info("✅ 完成")
 
 if __name__ == "__main__":
@@ -693,6 +1413,6 @@ if __name__ == "__main__":
         while True:
             try: run()
             except: pass
-            time.sleep(LOOP_INTERVAL_HOURS * 3600)
+            wait_for_mail(LOOP_INTERVAL_HOURS * 3600)
     else:
         run()